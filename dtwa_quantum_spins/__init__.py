@@ -15,7 +15,12 @@ from __future__ import division, print_function
     *Notes:
     *1. The initial state is currently hard coded to be the classical ground
     *    state
-    *2. Primary references are
+    *2. The dTWA objects limit the threads of mkl, if it is available, to
+    *    the cores per MPI process on each node. Other threaded BLAS
+    *    libraries read the thread count when numpy is first imported, so
+    *    set OMP_NUM_THREADS (or OPENBLAS_NUM_THREADS) to the same value
+    *    for mpiexec, e.g. to 1 if there is one MPI process per core
+    *3. Primary references are
     *   PRM:  arXiv:1510.03768
     *   Anatoli: Ann. Phys 325 (2010) 1790-1852
     *   Mauritz: arXiv:1209.3697
@@ -1,6 +1,5 @@
 #Class Library
 from mpi4py import MPI
-from reductions import Intracomm
 import numpy as np
 from itertools import starmap
 import operator as op
@@ -87,6 +86,10 @@ class ParamData:
 
 class OutData:
     """Class to store output data in this object"""
+    #Names of the observables, in the order of the constructor arguments
+    obs_names = ("sx", "sy", "sz", "sxvar", "syvar", "szvar", \
+      "sxyvar", "sxzvar", "syzvar")
+
     def __init__(self, t, sx, sy, sz, sxx, syy, szz, sxy, sxz, syz,\
       params):
         self.t_output = t
@@ -95,6 +98,24 @@ class OutData:
         self.sxyvar, self.sxzvar, self.syzvar = sxy, sxz, syz
         self.__dict__.update(params.__dict__)
 
+    @classmethod
+    def zeros(cls, t, params, dtype=np.float64):
+        """
+        Returns an OutData object with all observables set to 0 at the
+        times t, to accumulate the data from each trajectory in with 'iadd'
+        """
+        return cls(t, *[np.zeros(len(t), dtype=dtype) \
+          for name in cls.obs_names], params=params)
+
+    def iadd(self, other):
+        """
+        Adds the observables of another OutData object to these in place
+        """
+        for name in self.obs_names:
+            data = getattr(self, name)
+            data += getattr(other, name)
+        return self
+
     def normalize_data(self, w_totals, lsize):
         n, m, t = w_totals * lsize, w_totals * lsize * lsize, (1/lsize)
         (self.sx, self.sy, self.sz, self.sxvar, self.syvar, self.szvar, \
@@ -113,56 +134,19 @@ class OutData:
               (self.sx * self.sy),(self.sx * self.sz),(self.sy * self.sz))))
 
 
-def sum_reduce_all_data(param, datalist_loc,t, mpcomm):
+def sum_reduce_all_data(param, data_loc,t, mpcomm):
     """
-    Does the parallel sum reduction of all data
+    Does the parallel sum reduction of all data, given the sums of the
+    observables over the local trajectories in the OutData object data_loc
     """
-    #Do local sums
-    sx_locsum = np.sum(data.sx for data in datalist_loc)
-    sy_locsum = np.sum(data.sy for data in datalist_loc)
-    sz_locsum = np.sum(data.sz for data in datalist_loc)
-    sxvar_locsum = np.sum(data.sxvar for data in datalist_loc)
-    syvar_locsum = np.sum(data.syvar for data in datalist_loc)
-    szvar_locsum = np.sum(data.szvar for data in datalist_loc)
-    sxyvar_locsum = np.sum(data.sxyvar for data in datalist_loc)
-    sxzvar_locsum = np.sum(data.sxzvar for data in datalist_loc)
-    syzvar_locsum = np.sum(data.syzvar for data in datalist_loc)
-
     #Only root processor will actually get the data
-    sx_totals = np.zeros_like(sx_locsum) if mpcomm.rank == root\
-      else None
-    sy_totals = np.zeros_like(sy_locsum) if mpcomm.rank == root\
-      else None
-    sz_totals = np.zeros_like(sz_locsum) if mpcomm.rank == root\
-      else None
-    sxvar_totals = np.zeros_like(sxvar_locsum) if mpcomm.rank == root\
-      else None
-    syvar_totals = np.zeros_like(syvar_locsum) if mpcomm.rank == root\
-      else None
-    szvar_totals = np.zeros_like(szvar_locsum) if mpcomm.rank == root\
-      else None
-    sxyvar_totals = np.zeros_like(sxyvar_locsum) if mpcomm.rank == root\
-      else None
-    sxzvar_totals = np.zeros_like(sxzvar_locsum) if mpcomm.rank == root\
-      else None
-    syzvar_totals = np.zeros_like(syzvar_locsum) if mpcomm.rank == root\
-      else None
-
-    #To prevent conflicts with other comms
-    duplicate_comm = Intracomm(mpcomm)
-    sx_totals = duplicate_comm.reduce(sx_locsum, root=root)
-    sy_totals = duplicate_comm.reduce(sy_locsum, root=root)
-    sz_totals = duplicate_comm.reduce(sz_locsum, root=root)
-    sxvar_totals = duplicate_comm.reduce(sxvar_locsum, root=root)
-    syvar_totals = duplicate_comm.reduce(syvar_locsum, root=root)
-    szvar_totals = duplicate_comm.reduce(szvar_locsum, root=root)
-    sxyvar_totals = duplicate_comm.reduce(sxyvar_locsum, root=root)
-    sxzvar_totals = duplicate_comm.reduce(sxzvar_locsum, root=root)
-    syzvar_totals = duplicate_comm.reduce(syzvar_locsum, root=root)
-
-    if mpcomm.rank == root:
-        return OutData(t, sx_totals, sy_totals, sz_totals, sxvar_totals, \
-            syvar_totals, szvar_totals, sxyvar_totals, sxzvar_totals,\
-              syzvar_totals, param)
-    else:
-        return None
+    totals = OutData.zeros(t, param, dtype=data_loc.sx.dtype) \
+      if mpcomm.rank == root else None
+
+    #Reduce the numpy buffers directly, so that nothing is pickled
+    for name in OutData.obs_names:
+        mpcomm.Reduce(getattr(data_loc, name), \
+          getattr(totals, name) if mpcomm.rank == root else None, \
+            op=MPI.SUM, root=root)
+
+    return totals
@@ -3,6 +3,8 @@ from numpy import eye, zeros
 
 threshold = 1e-4
 root = 0
+#Smallest lattice size for which precalculated einsum paths pay off
+einsum_path_minsize = 7
 #This is the kronecker delta symbol for vector indices
 deltaij = eye(3)
 #This is the Levi-Civita symbol for vector indices
@@ -10,6 +12,12 @@ eijk = zeros((3, 3, 3))
 eijk[0, 1, 2] = eijk[1, 2, 0] = eijk[2, 0, 1] = 1
 eijk[0, 2, 1] = eijk[2, 1, 0] = eijk[1, 0, 2] = -1
 
+#Large arrays in the dTWA objects that are not printed with the run parameters
+bigdata_attrs = frozenset(['dsdotdg', 'delta_eps_tensor', 'jmat', 'deltamn',\
+  'dsdt_buf', 'jmat_norm', 'jac_sparsity', 'einsum_paths',\
+    'einsum_batch_paths', 'batch_consts', 'gpu_consts', 'init_s_buf',\
+      'init_s_batch_buf'])
+
 #Progressbar widgets
 try:
     from progressbar import Bar, Counter, ETA, Percentage
@@ -2,11 +2,11 @@
 from __future__ import division, print_function
 
 from mpi4py import MPI
-from reductions import Intracomm
 from redirect_stdout import stdout_redirected
-import copy
+from multiprocessing import Pool
 import numpy as np
-from scipy.integrate import odeint
+from scipy.integrate import odeint, solve_ivp
+from scipy import sparse
 from pprint import pprint
 from tabulate import tabulate
 
@@ -22,6 +22,13 @@ try:
 except ImportError:
     mkl_avail = False
 
+#Try to import cupy for the GPU if it is available
+try:
+    import cupy
+    cupy_avail = True
+except ImportError:
+    cupy_avail = False
+
 #Try to import progressbars if available
 try:
     import progressbar
@@ -46,39 +53,232 @@ def func_dtwa_bbgky(s, t, param):
     sview = s.view()
     stensor = sview[0:3*N].reshape(3, N)
     gtensor = sview[3*N:].reshape(3, 3, N, N)
-    gtensor[:,:,range(N),range(N)] = 0.0 #Set the diagonals of g_munu to 0
+    #Set the diagonals of g_munu to 0. Strided slicing avoids building
+    #index arrays at every call
+    gtensor.reshape(3, 3, N*N)[:,:,::N+1] = 0.0
 
-    htensor = np.zeros_like(stensor)
-    htensor[0].fill(param.hvec[0])
-    htensor[1].fill(param.hvec[1])
-    htensor[2].fill(param.hvec[2])
-    Gtensor = np.einsum("mg,abgn->abmn", param.jmat, gtensor)/param.norm
+    #Contract J with each N X N block of g via matmul, so that BLAS does
+    #it in cache sized tiles instead of streaming g once per row of J
+    Gtensor = np.matmul(param.jmat_norm, gtensor)
     Mtensor = np.einsum("am,b,mn->abmn", stensor, param.jvec, \
-      param.jmat)/param.norm
-    hvec_dressed = htensor + np.einsum("llgm->lm", Mtensor)
+      param.jmat_norm)
+    hvec_dressed = param.hvec[:, np.newaxis] + np.einsum("llgm->lm", Mtensor)
     dtensor = gtensor + np.einsum("am,bn", stensor, stensor)
     dsdt_1 = func_dtwa(sview[0:3*N], t, param).reshape(3, N)
-    dsdt = dsdt_1 - \
-      2.0 * np.einsum("bcmm,b,abc->am", Gtensor, param.jvec, eijk)
+    #Write the time derivatives straight into the preallocated buffer
+    dsdt = param.dsdt_buf[0:3*N].reshape(3, N)
+    dgdt = param.dsdt_buf[3*N:].reshape(3, 3, N, N)
+    np.subtract(dsdt_1, \
+      2.0 * np.einsum("bcmm,b,abc->am", Gtensor, param.jvec, eijk), out=dsdt)
 
-    dgdt = -np.einsum("lbmn,abl->abmn", Mtensor, eijk) + \
-      np.einsum("lanm,abl->abmn", Mtensor, eijk)
+    np.einsum("lanm,abl->abmn", Mtensor, eijk, out=dgdt)
+    dgdt -= np.einsum("lbmn,abl->abmn", Mtensor, eijk)
 
     dgdt -= np.einsum("lm,kbmn,lka->abmn", hvec_dressed, gtensor, eijk) -\
       np.einsum("llnm,kbmn,lka->abmn", Mtensor, gtensor, eijk) +\
         np.einsum("ln,akmn,lkb->abmn", hvec_dressed, gtensor, eijk) -\
           np.einsum("llmn,akmn,lkb->abmn", Mtensor, gtensor, eijk)
 
-    dgdt -= np.einsum("l,km,lbmn,lka->abmn", \
-      param.jvec, stensor, Gtensor, eijk) + \
+    #Let einsum split these into pairwise contractions, which go to the
+    #vectorized (BLAS) kernels instead of one naive loop over all indices.
+    #The contraction paths are precalculated by init_bbgky_rhs
+    dgdt -= np.einsum("l,km,lbmn,lka->abmn", param.jvec, stensor, \
+      Gtensor, eijk, optimize=param.einsum_paths[0]) + \
         np.einsum("l,kn,lanm,lkb->abmn", param.jvec, stensor, \
-          Gtensor, eijk)
+          Gtensor, eijk, optimize=param.einsum_paths[1])
 
     dgdt += np.einsum("almn,lkmn,lkb->abmn", Mtensor, dtensor, eijk)\
       + np.einsum("blnm,lknm,lka->abmn", Mtensor, dtensor, eijk)
 
-    #Flatten it before returning
-    return np.concatenate((dsdt.flatten(), 2.0 * dgdt.flatten()))
+    dgdt *= 2.0
+    #The buffer is overwritten by the next call, and the integrator copies
+    #it, so there is no need to return a fresh array
+    return param.dsdt_buf
+
+def init_bbgky_rhs(param):
+    """
+    Precalculates and preallocates everything that func_dtwa_bbgky
+    needs at each call, and stores it in 'param', so that the RHS does
+    no more than the arithmetic when the integrator calls it.
+    """
+    N = param.latsize
+    #Preallocated output of the RHS, which is filled in at every call
+    param.dsdt_buf = np.empty(param.fullsize_2ndorder)
+    #Preallocated initial condition, which is filled in for every
+    #trajectory. The integrators copy it, so it can be reused
+    param.init_s_buf = np.empty(param.fullsize_2ndorder)
+    #The normalized hopping matrix used by the RHS, computed only once
+    param.jmat_norm = np.ascontiguousarray(param.jmat)/param.norm
+    assert param.jmat_norm.flags['C_CONTIGUOUS']
+    #Contraction paths of the multi-operand einsums in the RHS. For very
+    #small lattices, following a path costs more than the naive loop
+    stensor, gtensor = np.empty((3, N)), np.empty((3, 3, N, N))
+    if N >= einsum_path_minsize:
+        param.einsum_paths = [np.einsum_path(subscripts, param.jvec, \
+          stensor, gtensor, eijk, optimize="greedy")[0] for subscripts in \
+            ("l,km,lbmn,lka->abmn", "l,kn,lanm,lkb->abmn")]
+    else:
+        param.einsum_paths = [False, False]
+
+def func_dtwa_bbgky_batch(s, t, param, xp=np):
+    """
+    The RHS of func_dtwa_bbgky for a batch of trajectories, whose states
+    are stacked one after the other in s. The integrator then evolves
+    the whole batch at once, and every contraction below loops over the
+    batch (leading) axis inside numpy. 'xp' is the array module of s,
+    numpy, or cupy to evaluate the RHS on the GPU (see init_bbgky_gpu).
+    """
+    N = param.latsize
+    #The constant arrays, living on the same device as s
+    (jvec, hvec, jmat_norm, levi, paths) = param.batch_consts \
+      if xp is np else param.gpu_consts
+    nbatch = s.size // param.fullsize_2ndorder
+    sview = s.view().reshape(nbatch, param.fullsize_2ndorder)
+    stensor = sview[:, 0:3*N].reshape(nbatch, 3, N)
+    gtensor = sview[:, 3*N:].reshape(nbatch, 3, 3, N, N)
+    gtensor.reshape(nbatch, 3, 3, N*N)[..., ::N+1] = 0.0
+
+    Gtensor = xp.matmul(jmat_norm, gtensor)
+    Mtensor = xp.einsum("...am,b,mn->...abmn", stensor, jvec, jmat_norm)
+    hvec_dressed = hvec[:, np.newaxis] + xp.einsum("...llgm->...lm", Mtensor)
+    dtensor = gtensor + xp.einsum("...am,...bn->...abmn", stensor, stensor)
+    #First order part, as in func_dtwa
+    hvec_drive = xp.asarray(param.hvec * np.array([1.0, 1.0, drive(t, param)]))
+    jsvec = 2.0 * (jvec[:, np.newaxis] * \
+      xp.matmul(stensor, jmat_norm.T) + hvec_drive[:, np.newaxis])
+    dsdt_1 = xp.einsum("abc,...bm,...cm->...am", levi, stensor, jsvec)
+
+    dsdt_full = xp.empty_like(sview)
+    dsdt = dsdt_full[:, 0:3*N].reshape(nbatch, 3, N)
+    dgdt = dsdt_full[:, 3*N:].reshape(nbatch, 3, 3, N, N)
+    dsdt[...] = dsdt_1 - \
+      2.0 * xp.einsum("...bcmm,b,abc->...am", Gtensor, jvec, levi)
+
+    dgdt[...] = xp.einsum("...lanm,abl->...abmn", Mtensor, levi)
+    dgdt -= xp.einsum("...lbmn,abl->...abmn", Mtensor, levi)
+
+    dgdt -= xp.einsum("...lm,...kbmn,lka->...abmn", hvec_dressed, \
+      gtensor, levi) - xp.einsum("...llnm,...kbmn,lka->...abmn", \
+        Mtensor, gtensor, levi) + xp.einsum("...ln,...akmn,lkb->...abmn", \
+          hvec_dressed, gtensor, levi) - \
+            xp.einsum("...llmn,...akmn,lkb->...abmn", Mtensor, gtensor, levi)
+
+    dgdt -= xp.einsum("l,...km,...lbmn,lka->...abmn", jvec, stensor, \
+      Gtensor, levi, optimize=paths[0]) + \
+        xp.einsum("l,...kn,...lanm,lkb->...abmn", jvec, stensor, \
+          Gtensor, levi, optimize=paths[1])
+
+    dgdt += xp.einsum("...almn,...lkmn,lkb->...abmn", Mtensor, dtensor, \
+      levi) + xp.einsum("...blnm,...lknm,lka->...abmn", Mtensor, dtensor, \
+        levi)
+
+    dgdt *= 2.0
+    return dsdt_full.reshape(-1)
+
+def init_bbgky_batch_rhs(param):
+    """
+    Precalculates the contraction paths of func_dtwa_bbgky_batch for
+    batches of param.batch_size trajectories, and stores them in 'param'
+    along with the other constant arrays of the RHS.
+    Needs init_bbgky_rhs to have been called first.
+    """
+    N = param.latsize
+    #Preallocated initial conditions of a batch, like init_s_buf
+    param.init_s_batch_buf = np.empty((param.batch_size, \
+      param.fullsize_2ndorder))
+    stensor = np.empty((param.batch_size, 3, N))
+    gtensor = np.empty((param.batch_size, 3, 3, N, N))
+    if N >= einsum_path_minsize:
+        param.einsum_batch_paths = [np.einsum_path(subscripts, \
+          param.jvec, stensor, gtensor, eijk, optimize="greedy")[0] \
+            for subscripts in ("l,...km,...lbmn,lka->...abmn", \
+              "l,...kn,...lanm,lkb->...abmn")]
+    else:
+        param.einsum_batch_paths = [False, False]
+    param.batch_consts = (param.jvec, param.hvec, param.jmat_norm, eijk, \
+      param.einsum_batch_paths)
+
+def init_bbgky_gpu(param):
+    """
+    Copies the constant arrays of func_dtwa_bbgky_batch to the GPU, and
+    stores them in 'param'. Needs init_bbgky_batch_rhs to have been
+    called first.
+    """
+    param.gpu_consts = tuple(cupy.asarray(x) for x in \
+      (param.jvec, param.hvec, param.jmat_norm, eijk)) + \
+        (param.einsum_batch_paths,)
+
+#The Dormand-Prince tableau of the embedded 5(4) Runge-Kutta method
+_rk45_c = np.array([0.0, 1.0/5, 3.0/10, 4.0/5, 8.0/9, 1.0, 1.0])
+_rk45_a = [[], [1.0/5], [3.0/40, 9.0/40], [44.0/45, -56.0/15, 32.0/9], \
+  [19372.0/6561, -25360.0/2187, 64448.0/6561, -212.0/729], \
+    [9017.0/3168, -355.0/33, 46732.0/5247, 49.0/176, -5103.0/18656], \
+      [35.0/384, 0.0, 500.0/1113, 125.0/192, -2187.0/6784, 11.0/84]]
+#Difference between the 5th and the embedded 4th order weights
+_rk45_e = np.array([71.0/57600, 0.0, -71.0/16695, 71.0/1920, \
+  -17253.0/339200, 22.0/525, -1.0/40])
+
+def rk45_batch(func, y0, t_output, args=(), xp=np, rtol=1.49012e-8, \
+  atol=1.49012e-8, h0=None, max_steps=1000000):
+    """
+    Evolves y0 with the RHS func(y, t, *args, xp=xp) by the embedded
+    Dormand-Prince 5(4) method with adaptive time steps, which are cut
+    to land on each time in t_output. Unlike odeint, all the arithmetic
+    stays in the array module 'xp', so that the state never leaves the
+    GPU if xp is cupy. The error is controlled in the max norm over the
+    whole state. h0 = 0, like None, lets the first step be chosen here.
+    Raises a FloatingPointError as soon as the error estimate is not
+    finite, and a ValueError if the times in t_output do not increase.
+    Returns the states at each time in t_output, as rows of an array of
+    module xp.
+    """
+    if np.any(np.diff(t_output) <= 0.0):
+        raise ValueError("rk45_batch: the output times must increase")
+    y = xp.array(y0, dtype=np.float64)
+    s = xp.empty((len(t_output), y.size), dtype=np.float64)
+    s[0] = y
+    t = t_output[0]
+    k = [func(y, t, *args, xp=xp)] + [None] * 6
+    #Like odeint, take h0 = 0 to mean that the integrator chooses it
+    h = h0 if h0 is not None and h0 > 0.0 else \
+      1e-3 * (t_output[-1] - t_output[0])
+    nsteps = 0
+    for (row, t_next) in enumerate(t_output[1:], 1):
+        while t < t_next:
+            if nsteps == max_steps:
+                raise RuntimeError("rk45_batch: too many steps at t = %g"%t)
+            nsteps += 1
+            last_step = (h >= t_next - t)
+            hstep = t_next - t if last_step else h
+            for stage in xrange(1, 7):
+                ystage = y.copy()
+                for (a, kk) in zip(_rk45_a[stage], k):
+                    if a != 0.0:
+                        ystage += (hstep * a) * kk
+                k[stage] = func(ystage, t + _rk45_c[stage] * hstep, \
+                  *args, xp=xp)
+            #The 7th stage is the 5th order solution at t + hstep
+            yerr = hstep * sum(e * kk for (e, kk) in zip(_rk45_e, k) \
+              if e != 0.0)
+            scale = atol + rtol * xp.maximum(xp.abs(y), xp.abs(ystage))
+            err = float(xp.max(xp.abs(yerr) / scale))
+            #cupy does not trap floating point errors, so a NaN or inf in the
+            #state would otherwise shrink the step until max_steps
+            if not np.isfinite(err):
+                raise FloatingPointError(\
+                  "invalid value in the integrator at t = %g" % t)
+            if err <= 1.0:
+                t, y = (t_next if last_step else t + hstep), ystage
+                #First same as last: reuse the last stage
+                k[0] = k[6]
+            factor = 10.0 if err == 0.0 else 0.9 * err**-0.2
+            factor = min(10.0, max(0.2, factor))
+            #A step that was only cut short to land on t_next says nothing
+            #against the untruncated step, so do not shrink h to it
+            h = max(h, hstep * factor) if last_step and err <= 1.0 \
+              else hstep * factor
+        s[row] = y
+    return s
 
 def jac_dtwa_bbgky(s, t, param):
     """
@@ -102,7 +302,9 @@ def jac_dtwa_bbgky(s, t, param):
     hvec_dressed = htensor + np.einsum("llgm->lm", Mtensor)
 
 
-    full_jacobian = np.zeros(shape=(fullsize_2ndorder, fullsize_2ndorder))
+    #Every subblock is assigned below before it is updated, so there is
+    #no need to zero fill the (3N + 9N^2)^2 entries first
+    full_jacobian = np.empty(shape=(fullsize_2ndorder, fullsize_2ndorder))
 
     #J00 subblock
     full_jacobian[0:3*N, 0:3*N] = jac_dtwa(s, t, param)
@@ -174,6 +376,208 @@ def jac_dtwa_bbgky(s, t, param):
 
     return full_jacobian
 
+def jac_sparsity_dtwa_bbgky(N):
+    """
+    Sparsity pattern of the Jacobian of the general case. Second order.
+    Obtained term by term from func_dtwa_bbgky, assuming a hopping matrix
+    that is dense but for its diagonal. The vector indices are coupled by
+    the Levi-Civita symbols, and the site indices (mu, nu) of g_munu only
+    to (mu, nu), (nu, mu), and via J, (*, mu) or (*, nu). The diagonals of
+    g_munu are set to 0 in the RHS, so their columns are empty.
+    Returned as a CSR matrix.
+    """
+    ones3 = np.ones(3)
+    offdiag = 1.0 - deltaij
+    distinct = np.abs(eijk)
+    #Couplings of the vector indices, (a,b) for rows and (c,d) for columns
+    #From the h, M terms and G_{lb,mn}: (a,b) <- (c,b), c != a
+    v_ca = np.einsum("ac,bd->abcd", offdiag, deltaij).reshape(9, 9)
+    #From the h, M terms: (a,b) <- (a,d), d != b
+    v_db = np.einsum("ac,bd->abcd", deltaij, offdiag).reshape(9, 9)
+    #From G_{la,nm}: (a,b) <- (c,a), c != b
+    v_cb = np.einsum("da,cb->abcd", deltaij, offdiag).reshape(9, 9)
+    #From the M.g terms: (a,b) <- (c,d), with (c,d,b) or (c,d,a) distinct
+    v_cdb = np.einsum("cdb,a->abcd", distinct, ones3).reshape(9, 9)
+    v_cda = np.einsum("cda,b->abcd", distinct, ones3).reshape(9, 9)
+
+    #Couplings of the site pairs p = (m,n) = m*N + n to (rho, sigma)
+    pairs = np.arange(N*N)
+    m, n = pairs // N, pairs % N
+    rho = np.tile(np.arange(N), N*N)
+    p_rep, m_rep, n_rep = [np.repeat(x, N) for x in (pairs, m, n)]
+    def site_pattern(rows, cols, mask, shape=(N*N, N*N)):
+        return sparse.coo_matrix((np.ones(np.count_nonzero(mask)), \
+          (rows[mask], cols[mask])), shape=shape)
+    #(m,n) <- (m,n) and (m,n) <- (n,m)
+    s_same = site_pattern(pairs, pairs, m != n)
+    s_swap = site_pattern(pairs, n * N + m, m != n)
+    #(m,n) <- (rho,n) and (m,n) <- (rho,m), with rho != sigma
+    s_gn = site_pattern(p_rep, rho * N + n_rep, rho != n_rep)
+    s_gm = site_pattern(p_rep, rho * N + m_rep, rho != m_rep)
+
+    gg = sparse.kron(v_ca + v_db + v_cdb, s_same) + \
+      sparse.kron(v_cda, s_swap) + sparse.kron(v_ca, s_gn) + \
+        sparse.kron(v_cb, s_gm)
+    #ds^a_m/dt depends on g^{cd}_{rho m}, with (a, c, d) distinct
+    m_rep, rho = np.repeat(np.arange(N), N), rho[:N*N]
+    sg = sparse.kron(distinct.reshape(3, 9), \
+      site_pattern(m_rep, rho * N + m_rep, rho != m_rep, shape=(N, N*N)))
+    #ds^a/dt depends on all s^c with c != a, and dg/dt on all s
+    ss = sparse.kron(offdiag, np.ones((N, N)))
+    nrows, ncols = 9*N*N, 3*N
+    #Filled in CSR form directly, without a dense array in between
+    gs = sparse.csr_matrix((np.ones(nrows * ncols), \
+      np.tile(np.arange(ncols), nrows), \
+        np.arange(0, nrows * ncols + 1, ncols)), shape=(nrows, ncols))
+    pattern = sparse.bmat([[ss, sg], [gs, gg]], format="csr")
+    pattern.data[:] = 1.0
+    return pattern
+
+def _func_dtwa_bbgky_ivp(t, s, param):
+    """
+    func_dtwa_bbgky with the argument order of scipy.integrate.solve_ivp.
+    Works on copies, since solve_ivp holds on to both the state that it
+    passes and the derivatives that are returned.
+    """
+    return func_dtwa_bbgky(s.copy(), t, param).copy()
+
+def _bbgky_trajectory(param, sampling, seed, t_output, odeint_kwargs):
+    """
+    Samples the initial condition for a particular seed and evolves it
+    with the BBGKY equations. Returns the observables of this trajectory
+    as an OutData object, the abs square of the time derivative of the
+    Weyl symbol of the Hamiltonian summed over its rows (None if not
+    verbose) and the integrator output info.
+    """
+    s_init_spins, s_init_corrs = sample(param, sampling, \
+      seed + param.seed_offset)
+    N = param.latsize
+    init_s = param.init_s_buf
+    init_s[0:3*N], init_s[3*N:] = s_init_spins, s_init_corrs
+    #Redirect unwanted stdout warning messages to /dev/null
+    with stdout_redirected():
+        if param.sparse_jac:
+            #Same default tolerances as odeint, as in rk45_batch
+            ivp_kwargs = dict(method="BDF", rtol=1.49012e-8, atol=1.49012e-8)
+            ivp_kwargs.update(odeint_kwargs)
+            sol = solve_ivp(lambda t, y: _func_dtwa_bbgky_ivp(t, y, param), \
+              (t_output[0], t_output[-1]), init_s, t_eval=t_output, \
+                jac_sparsity=param.jac_sparsity, **ivp_kwargs)
+            if not sol.success:
+                raise RuntimeError("%s, in the trajectory with seed %d" \
+                  % (sol.message, seed))
+            s = sol.y.T
+            info = {"nfev": sol.nfev, "njev": sol.njev, "nlu": sol.nlu, \
+              "message": sol.message}
+        else:
+            if param.jac:
+                s = odeint(func_dtwa_bbgky, init_s, t_output, \
+                  args=(param,), Dfun=jac_dtwa_bbgky, **odeint_kwargs)
+            else:
+                s = odeint(func_dtwa_bbgky, init_s, t_output, \
+                  args=(param,), Dfun=None, **odeint_kwargs)
+            (s, info) = s if type(s) is tuple else (s, None)
+    check_invalid(s)
+    #Computes |dH/dt|^2 for a particular alphavec & weighes it
+    #If the rms over alphavec of these are 0, then each H is const
+    dhwdt_abs2 = dhwdt_abs2_sum(s, t_output, param) if param.verbose \
+      else None
+
+    #The observables are sums over at most N^2 sites of O(1) values, which
+    #do not need compensated summation in double precision. Only widen
+    #the memory to long double to reduce overflows if asked to
+    if param.high_precision:
+        s = np.array(s, dtype=np.longdouble)
+    localdata = bbgky_observables(t_output, s, param)
+    return localdata, dhwdt_abs2, info
+
+def _bbgky_batch(param, sampling, seeds, t_output, odeint_kwargs):
+    """
+    Evolves the trajectories for a batch of seeds with _evolve_batch.
+    Overflows are let through, but an invalid value (NaN) aborts the
+    batch with a FloatingPointError that names its seeds, instead of
+    propagating into the sums of the observables over all trajectories.
+    """
+    with np.errstate(over='ignore', divide='ignore', invalid='raise'):
+        try:
+            return _evolve_batch(param, sampling, seeds, t_output, \
+              odeint_kwargs)
+        except FloatingPointError as err:
+            raise FloatingPointError("%s, in the trajectories with seeds %s"\
+              % (err, [int(seed) for seed in seeds]))
+
+def _evolve_batch(param, sampling, seeds, t_output, odeint_kwargs):
+    """
+    Evolves the trajectories for a batch of seeds together, stacked in a
+    single odeint call with func_dtwa_bbgky_batch, or with rk45_batch
+    on the GPU. Otherwise, falls back to one call of _bbgky_trajectory
+    per seed if there is only one seed, or if any jacobian is needed.
+    Returns a list with the output of _bbgky_trajectory for each seed.
+    """
+    if not param.use_gpu and \
+      (len(seeds) == 1 or param.jac or param.sparse_jac):
+        return [_bbgky_trajectory(param, sampling, seed, t_output, \
+          odeint_kwargs) for seed in seeds]
+    N = param.latsize
+    nbatch = len(seeds)
+    init_s = param.init_s_batch_buf[0:nbatch]
+    for (row, seed) in zip(init_s, seeds):
+        s_init_spins, s_init_corrs = sample(param, sampling, \
+          seed + param.seed_offset)
+        row[0:3*N], row[3*N:] = s_init_spins, s_init_corrs
+    if param.use_gpu:
+        #Only the tolerances of the odeint keyword arguments apply here
+        rk45_kwargs = dict((k, v) for (k, v) in odeint_kwargs.items() \
+          if k in ("rtol", "atol", "h0"))
+        s = cupy.asnumpy(rk45_batch(func_dtwa_bbgky_batch, \
+          cupy.asarray(init_s.reshape(-1)), t_output, args=(param,), \
+            xp=cupy, **rk45_kwargs))
+        info = None
+    else:
+        #Redirect unwanted stdout warning messages to /dev/null
+        with stdout_redirected():
+            s = odeint(func_dtwa_bbgky_batch, init_s.reshape(-1), \
+              t_output, args=(param,), Dfun=None, **odeint_kwargs)
+            (s, info) = s if type(s) is tuple else (s, None)
+    check_invalid(s)
+    s = s.reshape(len(t_output), nbatch, param.fullsize_2ndorder)
+    batchdata = []
+    for traj in xrange(nbatch):
+        s_traj = s[:, traj]
+        dhwdt_abs2 = dhwdt_abs2_sum(s_traj, t_output, param) \
+          if param.verbose else None
+        if param.high_precision:
+            s_traj = np.array(s_traj, dtype=np.longdouble)
+        localdata = bbgky_observables(t_output, s_traj, param)
+        batchdata.append((localdata, dhwdt_abs2, info))
+    return batchdata
+
+#Arguments common to all trajectories run by a pool worker
+_traj_args = None
+
+def _init_traj_worker(param, sampling, t_output, odeint_kwargs):
+    """
+    Initializer of the pool workers. The workers are forked, so the
+    arguments (and the MPI communicator in 'param') are inherited, not
+    pickled.
+    """
+    global _traj_args
+    #Each worker runs one trajectory at a time, so keep BLAS serial
+    if mkl_avail:
+        mkl.set_num_threads(1)
+    _traj_args = (param, sampling, t_output, odeint_kwargs)
+
+def _run_traj_batch(seeds):
+    """
+    Runs the trajectories for a batch of seeds in a pool worker. Only the
+    observable arrays are sent back, since OutData objects carry all the
+    parameters, including the MPI communicator, which does not pickle.
+    """
+    param, sampling, t_output, odeint_kwargs = _traj_args
+    return [(tuple(getattr(localdata, name) for name in OutData.obs_names),\
+      dhwdt_abs2, info) for (localdata, dhwdt_abs2, info) in \
+        _bbgky_batch(param, sampling, seeds, t_output, odeint_kwargs)]
+
 class Dtwa_BBGKY_System:
     """
       Class that creates the dTWA system.
@@ -190,7 +594,9 @@ class Dtwa_BBGKY_System:
 
     def __init__(self, params, mpicomm, n_t=2000,\
                             seed_offset=0,  jac=False,\
-                              verbose=True):
+                              verbose=True, cores_per_rank=1,\
+                                high_precision=False, sparse_jac=False,\
+                                  batch_size=1, use_gpu=False):
         """
         Initiates an instance of the Dtwa_System class. Copies parameters
         over from an instance of ParamData and stores precalculated objects .
@@ -234,6 +640,51 @@ class Dtwa_BBGKY_System:
                               of the Weyl symbol of the Hamiltonian that you
                               have provided via the 'hopmat' and other input
                               in ParamData. Defaults to 'False'.
+           cores_per_rank   = Number of worker processes that each MPI
+                              process forks to evolve its share of the
+                              initial conditions in parallel. Set this to
+                              the number of cores per node divided by the
+                              number of MPI processes per node. Defaults to
+                              1, i.e. no worker processes.
+           high_precision   = Boolean for widening the trajectories to long
+                              double precision before computing the
+                              observables, in case they overflow in double
+                              precision. This is slow, since long double
+                              arithmetic is not vectorized. Defaults to False.
+           sparse_jac       = Boolean for integrating the sampled initial
+                              conditions with the stiff solvers in
+                              scipy.integrate.solve_ivp instead of odeint.
+                              The solver estimates the jacobian by finite
+                              differences, grouping the columns allowed by
+                              its sparsity pattern, which is precalculated.
+                              The keyword arguments of 'evolve' are then
+                              passed to solve_ivp. The method defaults to
+                              "BDF", and rtol and atol default to 1.49012e-8
+                              as in odeint. A failed integration raises a
+                              RuntimeError. Overrides 'jac'.
+                              Defaults to False.
+                              WARNING: The sparsity pattern has O(size^3)
+                              entries.
+           batch_size       = Number of initial conditions that are stacked
+                              and evolved together in one call to odeint,
+                              so that the RHS is vectorized over all of them.
+                              The integrator then takes the same time steps
+                              for the whole batch. Its error norm is taken
+                              over the whole stacked state, so the error of
+                              a single trajectory is diluted by up to
+                              sqrt(batch_size). Scale 'rtol' and 'atol'
+                              down by that factor to keep the tolerance of
+                              each trajectory. Ignored if 'jac' or
+                              'sparse_jac' is set. Defaults to 1.
+           use_gpu          = Boolean for evolving each batch of initial
+                              conditions on the GPU with cupy. The
+                              integrator is then the adaptive Runge-Kutta
+                              method in 'rk45_batch' instead of odeint,
+                              and only the 'rtol', 'atol' and 'h0' keyword
+                              arguments of 'evolve' are used. Overrides
+                              'jac', 'sparse_jac' and 'cores_per_rank'.
+                              Set 'batch_size' large enough to keep the GPU
+                              busy. Defaults to False.
 
           Return value:
           An object that stores all the parameters above. If bbgky
@@ -246,10 +697,23 @@ class Dtwa_BBGKY_System:
         self.jac = jac
         self.n_t = n_t
         self.comm = mpicomm
+        limit_blas_threads(mpicomm)
         self.seed_offset = seed_offset
         #Booleans for verbosity and for calculating site data
         self.verbose = verbose
+        self.cores_per_rank = cores_per_rank
+        self.high_precision = high_precision
+        self.sparse_jac = sparse_jac
+        self.batch_size = batch_size
+        self.use_gpu = use_gpu
+        if self.use_gpu and not cupy_avail:
+            raise ImportError("use_gpu=True needs cupy, which is unavailable")
         N = params.latsize
+        init_bbgky_rhs(self)
+        if self.batch_size > 1 or self.use_gpu:
+            init_bbgky_batch_rhs(self)
+        if self.use_gpu:
+            init_bbgky_gpu(self)
 
         #Only computes these if you want 2nd order
         if self.jac:
@@ -269,109 +733,87 @@ class Dtwa_BBGKY_System:
             #The time independent part of the 10 subblock (dg_dot/ds):
             #is the SAME as ds_dot/dg
 
+        if self.sparse_jac:
+            self.jac_sparsity = jac_sparsity_dtwa_bbgky(N)
+
     def dtwa_bbgky(self, time_info, sampling, **odeint_kwargs):
         comm = self.comm
-        old_settings = np.seterr(all='ignore') #Prevent overflow warnings
         N = self.latsize
         rank = comm.rank
         if rank == root and self.verbose:
             pprint("# Run parameters:")
-            #Copy params to another object, then delete
-            #the output that you don't want printed
-            out = copy.copy(self)
-            out.dsdotdg = 0.0
-            out.delta_eps_tensor = 0.0
-            out.jmat = 0.0
-            out.deltamn = 0.0
-            pprint(vars(out), depth=2)
+            #Leave out the big arrays that you don't want printed
+            pprint(dict((k, v) for (k, v) in vars(self).items() \
+              if k not in bigdata_attrs), depth=2)
         if rank == root and not self.verbose:
             pprint("# Starting run ...")
-        if type(time_info) is tuple:
-            (t_init, t_final, n_steps) = time_info
-            dt = (t_final-t_init)/(n_steps-1.0)
-            t_output = np.arange(t_init, t_final, dt)
-        elif type(time_info) is list  or np.ndarray:
-            t_output = time_info
-        elif rank == root:
-            print("Please enter either a tuple or a list for the time interval")
-            exit(0)
-        else:
-            exit(0)
-
-        #Let each process get its chunk of n_t by round robin
-        nt_loc = 0
-        iterator = rank
-        while iterator < self.n_t:
-            nt_loc += 1
-            iterator += comm.size
+        t_output = bcast_t_output(time_info, comm)
+
+        #Each process gets its own nt_loc unique seeds for generating
+        #unique random number arrays, and allocates nt_loc initial conditions
+        local_seeds = bcast_local_seeds(self.n_t, comm)
+        nt_loc = local_seeds.size
         if pbar_avail:
             if self.comm.rank == root and self.verbose:
                 pbar_max = nt_loc-1
                 bar = progressbar.ProgressBar(widgets=widgets_bbgky,\
                   max_value=pbar_max, redirect_stdout=False)
 
-        #Scatter unique seeds for generating unique random number arrays :
-        #each processor gets its own nt_loc seeds, and allocates nt_loc
-        #initial conditions. Each i.c. is a 2N sized array
-        #now, each process sends its value of nt_loc to root
-        all_ntlocs = comm.gather(nt_loc, root=root)
-        #Let the root process initialize nt unique integers for random seeds
-        if rank == root:
-            all_seeds = np.arange(self.n_t, dtype=np.int64)+1
-            all_ntlocs = np.array(all_ntlocs)
-            all_displacements = np.roll(np.cumsum(all_ntlocs), root+1)
-            all_displacements[root] = 0 # First displacement
-        else:
-            all_seeds = None
-            all_displacements = None
-        local_seeds = np.zeros(nt_loc, dtype=np.int64)
-        #Root scatters nt_loc sized seed data to that particular process
-        comm.Scatterv([all_seeds, all_ntlocs, all_displacements,\
-          MPI.DOUBLE],local_seeds)
 
-        list_of_local_data = []
+        #Sums of the observables over the local trajectories
+        local_sums = OutData.zeros(t_output, self, \
+          dtype=np.longdouble if self.high_precision else np.float64)
 
         if self.verbose:
-            list_of_dhwdt_abs2 = []
-
-        for runcount in xrange(0, nt_loc, 1):
-            s_init_spins, s_init_corrs = sample(self, sampling, \
-              local_seeds[runcount] + self.seed_offset)
-            #Redirect unwanted stdout warning messages to /dev/null
-            with stdout_redirected():
-                if self.jac:
-                    s = odeint(func_dtwa_bbgky, \
-                      np.concatenate((s_init_spins, s_init_corrs)), t_output, \
-                        args=(self,), Dfun=jac_dtwa_bbgky, **odeint_kwargs)
-                else:
-                    s = odeint(func_dtwa_bbgky, \
-                      np.concatenate((s_init_spins, s_init_corrs)),t_output, \
-                        args=(self,), Dfun=None, **odeint_kwargs)
-                (s, info) = s if type(s) is tuple else (s, None)
-            #Computes |dH/dt|^2 for a particular alphavec & weighes it
-            #If the rms over alphavec of these are 0, then each H is const
-            if self.verbose:
-                hws = weyl_hamilt(s,t_output, self)
-                dhwdt = np.array([t_deriv(hw, t_output) for hw in hws])
-                dhwdt_abs2 = np.square(dhwdt)
-                list_of_dhwdt_abs2.extend(dhwdt_abs2)
-
-            s = np.array(s, dtype="float128")#Widen memory to reduce overflows
-            localdata = bbgky_observables(t_output, s, self)
-            list_of_local_data.append(localdata)
-            if self.verbose and pbar_avail and self.comm.rank == root:
-                bar.update(runcount)
+            dhwdt_abs2_locsum = np.zeros(len(t_output))
+
+        #Farm the batches of trajectories out to a pool of worker processes
+        #if this rank has more than one core to itself. Forked workers can
+        #not share the GPU context of this process
+        seed_batches = [local_seeds[i:i+self.batch_size] \
+          for i in xrange(0, nt_loc, self.batch_size)]
+        if self.cores_per_rank > 1 and not self.use_gpu:
+            pool = Pool(processes=self.cores_per_rank, \
+              initializer=_init_traj_worker, \
+                initargs=(self, sampling, t_output, odeint_kwargs))
+            batches = pool.imap(_run_traj_batch, seed_batches)
+        else:
+            pool = None
+            batches = (_bbgky_batch(self, sampling, seeds, t_output, \
+              odeint_kwargs) for seeds in seed_batches)
+        trajectories = (traj for batch in batches for traj in batch)
+
+        #Kill the workers, each a fork of this MPI process, if a trajectory
+        #fails, instead of leaving them behind
+        try:
+            for runcount, (localdata, dhwdt_abs2, info) in \
+              enumerate(trajectories):
+                if pool is not None:
+                    localdata = OutData(t_output, *localdata, params=self)
+                local_sums.iadd(localdata)
+                if self.verbose:
+                    dhwdt_abs2_locsum += dhwdt_abs2
+                if self.verbose and pbar_avail and self.comm.rank == root:
+                    bar.update(runcount)
+        except:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
 
         #After loop above  sum reduce (don't forget to average) all locally
         #calculated expectations at each time to root
         outdat = \
-          sum_reduce_all_data(self, list_of_local_data, t_output, comm)
+          sum_reduce_all_data(self, local_sums, t_output, comm)
         if self.verbose:
-            dhwdt_abs2_locsum = np.sum(list_of_dhwdt_abs2, axis=0)
             dhwdt_abs2_totals = np.zeros_like(dhwdt_abs2_locsum)\
               if rank == root else None
-            temp_comm = Intracomm(comm)
-            dhwdt_abs2_totals = temp_comm.reduce(dhwdt_abs2_locsum, root=root)
+            comm.Reduce([dhwdt_abs2_locsum, MPI.DOUBLE], \
+              [dhwdt_abs2_totals, MPI.DOUBLE] if rank == root else None, \
+                op=MPI.SUM, root=root)
             if rank == root:
                 dhwdt_abs2_totals = dhwdt_abs2_totals/(self.n_t * N * N)
                 dhwdt_abs_totals = np.sqrt(dhwdt_abs2_totals)
@@ -387,14 +829,12 @@ class Dtwa_BBGKY_System:
                 print(tabulate({"time": t_output, \
                   "dhwdt_abs": dhwdt_abs_totals}, \
                   headers="keys", floatfmt=".6f"))
-            if self.jac and self.verbose:
+            if self.jac and not self.sparse_jac and self.verbose:
                 print('# Cumulative number of Jacobian evaluations by root:', \
                   np.sum(info['nje']))
             print('# Done!')
-            np.seterr(**old_settings)  # reset to default
             return outdat
         else:
-            np.seterr(**old_settings)  # reset to default
             return None
 
     def evolve(self, time_info, sampling="spr", **odeint_kwargs):
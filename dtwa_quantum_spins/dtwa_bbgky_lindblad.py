@@ -2,9 +2,7 @@
 from __future__ import division, print_function
 
 from mpi4py import MPI
-from reductions import Intracomm
 from redirect_stdout import stdout_redirected
-import copy
 import numpy as np
 #from scipy.integrate import odeint
 from scipy.integrate import odeint
@@ -16,7 +14,7 @@ from funcs import *
 from classes import *
 from dumpstate import *
 from dtwa_only import func_dtwa
-from dtwa_bbgky import func_dtwa_bbgky
+from dtwa_bbgky import func_dtwa_bbgky, init_bbgky_rhs
 
 #Try to import mkl if it is available
 try:
@@ -126,6 +124,7 @@ class Dtwa_BBGKY_Lindblad_System:
         self.__dict__.update(params.__dict__)
         self.n_t = n_t
         self.comm = mpicomm
+        limit_blas_threads(mpicomm)
         self.seed_offset = seed_offset
         #Booleans for verbosity and for calculating site data
         self.verbose = verbose
@@ -134,100 +133,88 @@ class Dtwa_BBGKY_Lindblad_System:
         else:
             self.gamma_ud, self.gamma_du, self.gamma_el = 0.0, 0.0, 0.0
         self.gamma_r = self.gamma_ud + self.gamma_du
+        #Set up the closed system RHS, func_dtwa_bbgky
+        init_bbgky_rhs(self)
 
     def dtwa_bbgky(self, t_output, sampling, **odeint_kwargs):
         comm = self.comm
-        old_settings = np.seterr(all='ignore') #Prevent overflow warnings
         N = self.latsize
         rank = comm.rank
         if rank == root and self.verbose:
             pprint("# Run parameters:")
-            #Copy params to another object, then delete
-            #the output that you don't want printed
-            out = copy.copy(self)
-            out.dsdotdg = 0.0
-            out.delta_eps_tensor = 0.0
-            out.jmat = 0.0
-            out.deltamn = 0.0
-            pprint(vars(out), depth=2)
+            #Leave out the big arrays that you don't want printed
+            pprint(dict((k, v) for (k, v) in vars(self).items() \
+              if k not in bigdata_attrs), depth=2)
         if rank == root and not self.verbose:
             pprint("# Starting run ...")
-        #Let each process get its chunk of n_t by round robin
-        nt_loc = 0
-        iterator = rank
-        while iterator < self.n_t:
-            nt_loc += 1
-            iterator += comm.size
+        #Each process gets its own nt_loc unique seeds for generating
+        #unique random number arrays, and allocates nt_loc initial conditions
+        local_seeds = bcast_local_seeds(self.n_t, comm)
+        nt_loc = local_seeds.size
         if pbar_avail:
             if self.comm.rank == root and self.verbose:
                 pbar_max = nt_loc-1
                 bar = progressbar.ProgressBar(widgets=widgets_bbgky,\
                   max_value=pbar_max, redirect_stdout=False)
 
-        #Scatter unique seeds for generating unique random number arrays :
-        #each processor gets its own nt_loc seeds, and allocates nt_loc
-        #initial conditions. Each i.c. is a 2N sized array
-        #now, each process sends its value of nt_loc to root
+        #Each process sends its value of nt_loc to all others
         all_ntlocs = comm.gather(nt_loc, root=root)
         all_ntlocs = comm.bcast(all_ntlocs, root=root)
         all_ntlocs = np.array(all_ntlocs)
         if self.fullstate_times is not None:
             fulloutfile = open_statefile(self, filename=self.fullstate_outfile)
             build_statefile(fulloutfile, all_ntlocs,t_output, self)
-        #Let the root process initialize nt unique integers for random seeds
-        if rank == root:
-            all_seeds = np.arange(self.n_t, dtype=np.int64)+1
-            all_displacements = np.roll(np.cumsum(all_ntlocs), root+1)
-            all_displacements[root] = 0 # First displacement
-        else:
-            all_seeds = None
-            all_displacements = None
-        local_seeds = np.zeros(nt_loc, dtype=np.int64)
-        #Root scatters nt_loc sized seed data to that particular process
-        comm.Scatterv([all_seeds, all_ntlocs, all_displacements,\
-          MPI.DOUBLE],local_seeds)
 
-        list_of_local_data = []
+        #Sums of the observables over the local trajectories
+        local_sums = OutData.zeros(t_output, self, dtype=np.complex128)
 
         if self.verbose:
-            list_of_dhwdt_abs2 = []
+            dhwdt_abs2_locsum = np.zeros(len(t_output))
 
-        for runcount in xrange(0, nt_loc, 1):
-            s_init_spins, s_init_corrs = sample(self, sampling, \
-              local_seeds[runcount] + self.seed_offset)
-            #Redirect unwanted stdout warning messages to /dev/null
-            with stdout_redirected():
-                s = odeint(func_dtwa_bbgky_lindblad, \
-                  np.concatenate((s_init_spins, s_init_corrs)),t_output, \
-                    args=(self,), **odeint_kwargs)    
-                (s, info) = s if type(s) is tuple else (s, None)
-            if self.fullstate_times is not None:
-                dump_states(fulloutfile, s, runcount, t_output, self)
-            #Computes |dH/dt|^2 for a particular alphavec & weighes it
-            #If the rms over alphavec of these are 0, then each H is const
-            if self.verbose:
-                hws = weyl_hamilt(s,t_output, self)
-                dhwdt = np.array([t_deriv(hw, t_output) for hw in hws])
-                dhwdt_abs2 = np.square(dhwdt)
-                list_of_dhwdt_abs2.extend(dhwdt_abs2)
+        #Overflows are let through, but an invalid value (NaN) aborts the
+        #run instead of propagating into the sums of the observables
+        with np.errstate(over='ignore', divide='ignore', invalid='raise'):
+            for runcount in xrange(0, nt_loc, 1):
+                s_init_spins, s_init_corrs = sample(self, sampling, \
+                  local_seeds[runcount] + self.seed_offset)
+                init_s = self.init_s_buf
+                init_s[0:3*N], init_s[3*N:] = s_init_spins, s_init_corrs
+                #Redirect unwanted stdout warning messages to /dev/null
+                with stdout_redirected():
+                    try:
+                        s = odeint(func_dtwa_bbgky_lindblad, init_s, \
+                          t_output, args=(self,), **odeint_kwargs)
+                        (s, info) = s if type(s) is tuple else (s, None)
+                        check_invalid(s)
+                    except FloatingPointError as err:
+                        raise FloatingPointError(\
+                          "%s, in the trajectory with seed %d" % \
+                            (err, local_seeds[runcount]))
+                if self.fullstate_times is not None:
+                    dump_states(fulloutfile, s, runcount, t_output, self)
+                #Computes |dH/dt|^2 for a particular alphavec & weighes it
+                #If the rms over alphavec of these are 0, then each H is const
+                if self.verbose:
+                    dhwdt_abs2_locsum += dhwdt_abs2_sum(s, t_output, self)
 
-            s = np.array(s, dtype=np.complex128)#Widen memory to reduce overflows
-            localdata = bbgky_observables(t_output, s, self)
-            list_of_local_data.append(localdata)
-            if self.verbose and pbar_avail and self.comm.rank == root:
-                bar.update(runcount)
+                #Widen memory to reduce overflows
+                s = np.array(s, dtype=np.complex128)
+                localdata = bbgky_observables(t_output, s, self)
+                local_sums.iadd(localdata)
+                if self.verbose and pbar_avail and self.comm.rank == root:
+                    bar.update(runcount)
         if self.fullstate_times is not None:
             close_statefile(fulloutfile)
         #After loop above  sum reduce (don't forget to average) all locally
         #calculated expectations at each time to root
         outdat = \
-          sum_reduce_all_data(self, list_of_local_data, t_output, comm)
+          sum_reduce_all_data(self, local_sums, t_output, comm)
         if self.verbose:
-            dhwdt_abs2_locsum = np.sum(list_of_dhwdt_abs2, axis=0)
             dhwdt_abs2_totals = np.zeros_like(dhwdt_abs2_locsum)\
               if rank == root else None
-            temp_comm = Intracomm(comm)
-            dhwdt_abs2_totals = temp_comm.reduce(dhwdt_abs2_locsum, root=root)
+            comm.Reduce([dhwdt_abs2_locsum, MPI.DOUBLE], \
+              [dhwdt_abs2_totals, MPI.DOUBLE] if rank == root else None, \
+                op=MPI.SUM, root=root)
             if rank == root:
                 dhwdt_abs2_totals = dhwdt_abs2_totals/(self.n_t * N * N)
                 dhwdt_abs_totals = np.sqrt(dhwdt_abs2_totals)
@@ -244,10 +231,8 @@ class Dtwa_BBGKY_Lindblad_System:
                   "dhwdt_abs": dhwdt_abs_totals}, \
                   headers="keys", floatfmt=".6f"))
             print('# Done!')
-            np.seterr(**old_settings)  # reset to default
             return outdat
         else:
-            np.seterr(**old_settings)  # reset to default
             return None
 
     def evolve(self, time_info, sampling="spr", fullstate_times=None,\
@@ -312,17 +297,7 @@ class Dtwa_BBGKY_Lindblad_System:
                'sxvar, syvar, szvar, sxyvar, sxzvar, syzvar'
                respectively
         """
-        if type(time_info) is tuple:
-            (t_init, t_final, n_steps) = time_info
-            dt = (t_final-t_init)/(n_steps-1.0)
-            t_output = np.arange(t_init, t_final, dt)
-        elif type(time_info) is list  or np.ndarray:
-            t_output = time_info
-        elif rank == root:
-            print("Please enter either a tuple or a list for the time interval")
-            exit(0)
-        else:
-            exit(0)
+        t_output = bcast_t_output(time_info, self.comm)
         self.fullstate_times = fullstate_times    
         self.fullstate_outfile = fullstate_outfile
         return self.dtwa_bbgky(t_output, sampling, **odeint_kwargs)
@@ -153,6 +153,7 @@ class Dtwa_System:
         self.jac = jac
         self.n_t = n_t
         self.comm = mpicomm
+        limit_blas_threads(mpicomm)
         self.seed_offset = seed_offset
         #Booleans for verbosity and for calculating site data
         self.verbose = verbose
@@ -167,49 +168,20 @@ class Dtwa_System:
             pprint(vars(self), depth=2)
         if rank == root and not self.verbose:
             pprint("# Starting run ...")
-        if type(time_info) is tuple:
-            (t_init, t_final, n_steps) = time_info
-            dt = (t_final-t_init)/(n_steps-1.0)
-            t_output = np.arange(t_init, t_final, dt)
-        elif type(time_info) is list or np.ndarray:
-            t_output = time_info
-        elif rank == root:
-            print("Please enter either a tuple or a list for the time interval")
-            exit(0)
-        else:
-            exit(0)
+        t_output = bcast_t_output(time_info, comm)
 
-        #Let each process get its chunk of n_t by round robin
-        nt_loc = 0
-        iterator = rank
-        while iterator < self.n_t:
-            nt_loc += 1
-            iterator += comm.size
+        #Each process gets its own nt_loc unique seeds for generating
+        #unique random number arrays, and allocates nt_loc initial conditions
+        local_seeds = bcast_local_seeds(self.n_t, comm)
+        nt_loc = local_seeds.size
         if pbar_avail:
             if self.comm.rank == root and self.verbose:
                 pbar_max = nt_loc-1
                 bar = progressbar.ProgressBar(widgets=widgets_bbgky,\
                         max_value=pbar_max, redirect_stdout=False)
-        #Scatter unique seeds for generating unique random number arrays :
-        #each processor gets its own nt_loc seeds, and allocates nt_loc
-        #initial conditions. Each i.c. is a 2N sized array
-        #now, each process sends its value of nt_loc to root
-        all_ntlocs = comm.gather(nt_loc, root=root)
-        #Let the root process initialize nt unique integers for random seeds
-        if rank == root:
-            all_seeds = np.arange(self.n_t, dtype=np.int64)+1
-            all_ntlocs = np.array(all_ntlocs)
-            all_displacements = np.roll(np.cumsum(all_ntlocs), root+1)
-            all_displacements[root] = 0 # First displacement
-        else:
-            all_seeds = None
-            all_displacements = None
-        local_seeds = np.zeros(nt_loc, dtype=np.int64)
-        #Root scatters nt_loc sized seed data to that particular process
-        comm.Scatterv([all_seeds, all_ntlocs, all_displacements,\
-          MPI.DOUBLE], local_seeds)
 
-        list_of_local_data = []
+        #Sums of the observables over the local trajectories
+        local_sums = OutData.zeros(t_output, self)
 
         for runcount in xrange(0, nt_loc, 1):
             np.random.seed(local_seeds[runcount] + self.seed_offset)
@@ -258,14 +230,14 @@ class Dtwa_System:
             localdata = OutData(t_output, sx_expct, sy_expct,\
               sz_expct, sx_var, sy_var, sz_var, sxy_var, sxz_var, \
                 syz_var, self)
-            list_of_local_data.append(localdata)
+            local_sums.iadd(localdata)
             if self.verbose and pbar_avail and self.comm.rank == root:
                 bar.update(runcount)
 
         #After loop above  sum reduce (don't forget to average) all locally
         #calculated expectations at each time to root
         outdat = \
-          sum_reduce_all_data(self, list_of_local_data, t_output, comm)
+          sum_reduce_all_data(self, local_sums, t_output, comm)
 
         if rank == root:
             outdat.normalize_data(self.n_t, N)
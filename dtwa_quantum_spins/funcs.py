@@ -1,13 +1,100 @@
 #Some general functions
 import random
 import numpy as np
+from mpi4py import MPI
+from multiprocessing import cpu_count
 from scipy.signal import fftconvolve
 from consts import *
 from classes import *
 
+#Try to import mkl if it is available
+try:
+    import mkl
+    mkl_avail = True
+except ImportError:
+    mkl_avail = False
+
 def drive(t, param):
     return param.hdc + param.amp * np.cos(param.omega * t)
 
+def bcast_t_output(time_info, comm):
+    """
+    Builds the output times from time_info on root only, and broadcasts
+    them to all processes as a C contiguous array of doubles. time_info
+    is either a 3-tuple (t_init, t_final, n_steps) or a list or numpy
+    array of the times themselves. Exits all processes for anything else,
+    including malformed tuples and lists.
+    """
+    tsize = np.empty(1, dtype=np.int64)
+    if comm.rank == root:
+        try:
+            if isinstance(time_info, tuple):
+                (t_init, t_final, n_steps) = time_info
+                dt = (t_final-t_init)/(n_steps-1.0)
+                t_output = np.arange(t_init, t_final, dt)
+            elif isinstance(time_info, (list, np.ndarray)):
+                t_output = np.ascontiguousarray(time_info, dtype=np.float64)
+            else:
+                t_output = None
+        except (ValueError, TypeError, ZeroDivisionError):
+            t_output = None
+        if t_output is None:
+            print("Please enter either a tuple or a list for the time interval")
+        tsize[0] = -1 if t_output is None else t_output.size
+    comm.Bcast([tsize, MPI.INT64_T], root=root)
+    if tsize[0] < 0:
+        exit(0)
+    if comm.rank != root:
+        t_output = np.empty(tsize[0], dtype=np.float64)
+    comm.Bcast([t_output, MPI.DOUBLE], root=root)
+    return t_output
+
+def bcast_local_seeds(n_t, comm):
+    """
+    Broadcasts the unique seeds 1, ..., n_t of the random number arrays
+    for all the trajectories from root. Returns the seeds of this process,
+    which picks its own out of them by round robin.
+    """
+    all_seeds = np.empty(n_t, dtype=np.int64)
+    if comm.rank == root:
+        all_seeds[:] = np.arange(n_t, dtype=np.int64)+1
+    comm.Bcast([all_seeds, MPI.INT64_T], root=root)
+    return all_seeds[comm.rank::comm.size]
+
+def check_invalid(s):
+    """
+    Raises a FloatingPointError if the states s from the integrator hold
+    invalid values (NaN). The integrator can make these in its own
+    compiled code, where numpy does not trap them.
+    """
+    if np.isnan(s).any():
+        raise FloatingPointError("invalid value returned by the integrator")
+
+def blas_threads_per_rank(comm):
+    """
+    Returns the number of cores on this node per MPI process running on
+    it, so that the threaded BLAS of each process keeps off the cores of
+    the others. Falls back to all the processes in comm if the MPI
+    library cannot tell which ones share this node.
+    """
+    try:
+        nodecomm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        ranks_on_node = nodecomm.size
+        nodecomm.Free()
+    except (AttributeError, NotImplementedError):
+        ranks_on_node = comm.size
+    return max(1, cpu_count() // ranks_on_node)
+
+def limit_blas_threads(comm):
+    """
+    Limits the threads of mkl, if it is available, to the cores of each
+    node shared out among the MPI processes in comm that run on it. With
+    one MPI process per core, a multithreaded mkl would otherwise
+    oversubscribe the cores.
+    """
+    if mkl_avail:
+        mkl.set_num_threads(blas_threads_per_rank(comm))
+
 def sample(param, sampling, seed):
     """
     Different phase space sampling schemes for the initial state,
@@ -50,45 +137,27 @@ def bbgky_observables(t_output, s, params):
     return them as an 'OutData' object. This assumes bbgky routine.
     For dtwa only, the observables are coded inline
     """
-    sx_expct = np.sum(s[:, 0:N], axis=1)
-    sy_expct = np.sum(s[:, N:2*N], axis=1)
-    sz_expct = np.sum(s[:, 2*N:3*N], axis=1)
-
+    nt = s.shape[0]
     #svec  is the tensor s^l_\mu
     #G = s[3*N:].reshape(3,3,N,N) is the tensor g^{ab}_{\mu\nu}.
-    sview = s.view()
-    gt = sview[:, 3*N:].reshape(s.shape[0], 3, 3, N, N)
-    gt[:,:,:,range(N),range(N)] = 0.0 #Set the diagonals of g_munu to 0
-    #Quantum spin variance
-    sx_var = np.sum(gt[:,0,0,:,:], axis=(-1,-2))
-    sx_var += (np.sum(s[:, 0:N], axis=1)**2 \
-      - np.sum(s[:, 0:N]**2, axis=1))
-
-    sy_var = np.sum(gt[:,1,1,:,:], axis=(-1,-2))
-    sy_var += (np.sum(s[:, N:2*N], axis=1)**2 \
-    - np.sum(s[:, N:2*N]**2, axis=1))
+    stensor = s[:, 0:3*N].reshape(nt, 3, N)
+    gt = s[:, 3*N:].reshape(nt, 3, 3, N, N)
+    #All the site sums are taken in a single pass over each tensor
+    ssum = np.sum(stensor, axis=-1)
+    sprod_sum = np.einsum("tam,tbm->tab", stensor, stensor)
+    #Sum of g_munu, leaving out the diagonals of g_munu
+    gsum = np.sum(gt, axis=(-1,-2)) - np.trace(gt, axis1=-2, axis2=-1)
+    #Quantum spin (co)variance. The classical part is the sum over all
+    #pairs of sites, which is the product of the site sums, less the
+    #diagonal parts
+    var = gsum + np.einsum("ta,tb->tab", ssum, ssum) - sprod_sum
+    #Time as the last axis, contiguous
+    ssum = ssum.T.copy()
+    var = var.transpose(1, 2, 0).copy()
 
-    sz_var = np.sum(gt[:,2,2,:,:], axis=(-1,-2))
-    sz_var += (np.sum(s[:, 2*N:3*N], axis=1)**2 \
-    - np.sum(s[:, 2*N:3*N]**2, axis=1))
-
-    sxy_var = np.sum(gt[:,0,1,:,:], axis=(-1,-2))
-    sxy_var += np.sum([fftconvolve(s[m, 0:N], s[m, N:2*N]) \
-    for m in xrange(t_output.size)], axis=1)
-    #Remove the diagonal parts
-    sxy_var -= np.sum(s[:, 0:N] *  s[:, N:2*N], axis=1)
-
-    sxz_var = np.sum(gt[:,0,2,:,:], axis=(-1,-2))
-    sxz_var += np.sum([fftconvolve(s[m, 0:N], s[m, 2*N:3*N]) \
-      for m in xrange(t_output.size)], axis=1)
-    #Remove the diagonal parts
-    sxz_var -= np.sum(s[:, 0:N] *  s[:, 2*N:3*N], axis=1)
-
-    syz_var = np.sum(gt[:,1,2,:,:], axis=(-1,-2))
-    syz_var += np.sum([fftconvolve(s[m, N:2*N], s[m, 2*N:3*N]) \
-      for m in xrange(t_output.size)], axis=1)
-    #Remove the diagonal parts
-    syz_var -= np.sum(s[:, N:2*N] *  s[:, 2*N:3*N], axis=1)
+    sx_expct, sy_expct, sz_expct = ssum
+    sx_var, sy_var, sz_var = var[0,0], var[1,1], var[2,2]
+    sxy_var, sxz_var, syz_var = var[0,1], var[0,2], var[1,2]
 
     localdata = OutData(t_output, sx_expct, sy_expct,\
       sz_expct, sx_var, sy_var, sz_var, sxy_var, sxz_var, \
@@ -96,12 +165,17 @@ def bbgky_observables(t_output, s, params):
 
     return localdata
 
-def t_deriv(quantities, times):
+def t_deriv(quantities, times, axis=-1):
     """
     Computes the time derivative of quantities wrt times
+    along the given axis of quantities
     """
+    #Divide by the spacings explicitly: numpy >= 1.13 takes an array
+    #passed to np.gradient as the coordinates, not as the spacings
     dt = np.gradient(times)
-    return np.gradient(quantities, dt)
+    dt_shape = [1] * np.ndim(quantities)
+    dt_shape[axis] = dt.size
+    return np.gradient(quantities, axis=axis) / dt.reshape(dt_shape)
 
 def weyl_hamilt(s,times,param):
     """
@@ -121,3 +195,14 @@ def weyl_hamilt(s,times,param):
     hw += (param.hx * np.sum(s[:, 0:N]) +\
       param.hy * np.sum(s[:, N:2*N]) + param.hz * np.sum(s[:, 2*N:3*N]))
     return -hw
+
+def dhwdt_abs2_sum(s, times, param):
+    """
+    Evaluates |dH_w/dt|^2 for each row of the Weyl Symbols of the
+    Hamiltonian (see weyl_hamilt), and sums them up. The derivatives are
+    taken in one go and squared in place, so only one temporary of the
+    size of H_w is made.
+    """
+    dhwdt = t_deriv(weyl_hamilt(s, times, param), times)
+    dhwdt *= dhwdt
+    return np.sum(dhwdt, axis=0)